@@ -13,23 +13,113 @@ import subprocess
 import urllib.parse
 from datetime import datetime
 import json
+import threading
+import collections
+import itertools
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 from PyQt6.QtGui import QIcon, QFont
 from PyQt6.QtCore import QSize
 
+# 跳转到未下载片段时，连同其后的若干片段一起提到队首
+PRIORITY_WINDOW = 4
+# 播放器请求未下载片段时的最长等待时间（秒）
+SEGMENT_WAIT_TIMEOUT = 30
+
+
+class PreviewRequestHandler(BaseHTTPRequestHandler):
+    """边下边播：提供改写后的m3u8和已下载到本地的ts片段"""
+
+    def do_GET(self):
+        worker = self.server.worker
+        path = urllib.parse.urlparse(self.path).path.lstrip('/')
+
+        if path == 'playlist.m3u8':
+            self.send_content(worker.build_preview_playlist().encode('utf-8'),
+                              'application/vnd.apple.mpegurl')
+            return
+
+        index = worker.segment_index_from_name(path)
+        if index is None:
+            self.send_error(404)
+            return
+
+        segment_path = os.path.join(worker.output_dir, f"segment_{index}.ts")
+        if not os.path.exists(segment_path):
+            # 播放器跳转到了尚未下载的片段，通知下载线程优先下载
+            worker.prioritize_segment(index)
+            deadline = time.monotonic() + SEGMENT_WAIT_TIMEOUT
+            while not os.path.exists(segment_path):
+                # 片段暂时不可用（下载已停止或等待超时），播放器可稍后重试
+                if not worker.is_downloading or time.monotonic() > deadline:
+                    self.send_error(503)
+                    return
+                time.sleep(0.1)
+
+        with open(segment_path, 'rb') as f:
+            self.send_content(f.read(), 'video/mp2t')
+
+    def send_content(self, data, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # 不在控制台输出每个请求
+        pass
+
+
+class PreviewServer:
+    """本地HLS服务，运行在后台线程中
+
+    下载出错时立即关闭；下载成功后继续运行以便继续播放，
+    直到开始下一次下载或关闭主窗口。
+    """
+
+    def __init__(self, worker, host='127.0.0.1', port=0):
+        self.httpd = ThreadingHTTPServer((host, port), PreviewRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.worker = worker
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/playlist.m3u8"
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
 class DownloadWorker(QThread):
     progress_updated = pyqtSignal(int)
     download_completed = pyqtSignal()
     error_occurred = pyqtSignal(str)
     log_message = pyqtSignal(str)
+    preview_ready = pyqtSignal(str)
 
-    def __init__(self, url, headers, output_dir, max_workers):
+    def __init__(self, url, headers, output_dir, max_workers, enable_preview=False):
         super().__init__()
         self.url = url
         self.headers = headers
         self.output_dir = output_dir
         self.max_workers = max_workers
+        self.enable_preview = enable_preview
         self.is_paused = False
+        self.is_downloading = False
         self.downloaded_segments = set()
+        self.segment_durations = []
+        self.segment_discontinuities = []
+        self.pending_segments = collections.deque()
+        self.queue_lock = threading.Lock()
+        self.preview_server = None
 
     def pause(self):
         self.is_paused = True
@@ -43,7 +133,71 @@ class DownloadWorker(QThread):
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         self.log_message.emit(f"[{timestamp}] {message}")
 
+    def prioritize_segment(self, index):
+        """将指定片段及其后的几个片段移到下载队列最前面"""
+        with self.queue_lock:
+            if index not in self.pending_segments:
+                return  # 已下载或正在下载
+            ahead = [i for i in range(index, index + PRIORITY_WINDOW)
+                     if i in self.pending_segments]
+            if list(itertools.islice(self.pending_segments, len(ahead))) == ahead:
+                return  # 顺序播放，已在队首
+            for i in ahead:
+                self.pending_segments.remove(i)
+            self.pending_segments.extendleft(reversed(ahead))
+        self.log(f"播放跳转至片段 {index}，优先下载")
+
+    def segment_index_from_name(self, name):
+        """从 segment_{index}.ts 文件名中解析片段序号"""
+        if not (name.startswith('segment_') and name.endswith('.ts')):
+            return None
+        try:
+            index = int(name[len('segment_'):-len('.ts')])
+        except ValueError:
+            return None
+        # int()也接受 "03"、"+3"、" 3" 等写法，只认下载线程实际写出的文件名
+        if name != f"segment_{index}.ts":
+            return None
+        if 0 <= index < len(self.segment_durations):
+            return index
+        return None
+
+    def build_preview_playlist(self):
+        """生成指向本地片段的m3u8，片段列表完整以便播放器跳转"""
+        target_duration = max(self.segment_durations, default=0)
+        lines = [
+            '#EXTM3U',
+            '#EXT-X-VERSION:3',
+            f'#EXT-X-TARGETDURATION:{int(target_duration + 0.999)}',
+            '#EXT-X-MEDIA-SEQUENCE:0',
+            '#EXT-X-PLAYLIST-TYPE:VOD',
+        ]
+        for index, duration in enumerate(self.segment_durations):
+            if self.segment_discontinuities[index]:
+                lines.append('#EXT-X-DISCONTINUITY')
+            lines.append(f'#EXTINF:{duration:.3f},')
+            lines.append(f'segment_{index}.ts')
+        lines.append('#EXT-X-ENDLIST')
+        return '\n'.join(lines) + '\n'
+
+    def start_preview(self):
+        try:
+            self.preview_server = PreviewServer(self)
+            self.preview_server.start()
+            self.preview_ready.emit(self.preview_server.url)
+        except OSError as e:
+            self.preview_server = None
+            self.log(f"启动边下边播服务失败: {str(e)}")
+
+    def stop_preview(self):
+        # 下载线程和界面线程都可能调用，先在锁内取出再关闭
+        with self.queue_lock:
+            server, self.preview_server = self.preview_server, None
+        if server:
+            server.stop()
+
     def run(self):
+        self.is_downloading = True
         try:
             self.log(f"开始下载，URL: {self.url}")
             
@@ -107,56 +261,85 @@ class DownloadWorker(QThread):
             # 创建输出目录
             os.makedirs(self.output_dir, exist_ok=True)
 
-            # 下载所有分片
+            self.segment_durations = [segment.duration or 0 for segment in playlist.segments]
+            self.segment_discontinuities = [segment.discontinuity for segment in playlist.segments]
+            segment_urls = [segment.absolute_uri or urllib.parse.urljoin(base_uri, segment.uri)
+                            for segment in playlist.segments]
+            with self.queue_lock:
+                self.pending_segments = collections.deque(
+                    i for i in range(total_segments) if str(i) not in self.downloaded_segments
+                )
+
+            if self.enable_preview:
+                self.start_preview()
+
+            # 下载所有分片，按队列顺序提交，保证播放器跳转时可以调整顺序
             downloaded = len(self.downloaded_segments)
             with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-                futures = []
-                for index, segment in enumerate(playlist.segments):
-                    if str(index) in self.downloaded_segments:
-                        continue
-                        
+                futures = {}
+                while self.pending_segments or futures:
                     while self.is_paused:
                         self.msleep(100)
-                        
-                    segment_url = segment.absolute_uri or urllib.parse.urljoin(base_uri, segment.uri)
-                    future = executor.submit(
-                        self.download_segment,
-                        segment_url,
-                        os.path.join(self.output_dir, f"segment_{index}.ts"),
-                        index
-                    )
-                    futures.append(future)
 
-                for future in concurrent.futures.as_completed(futures):
-                    try:
-                        index = future.result()
-                        self.downloaded_segments.add(str(index))
-                        downloaded += 1
-                        progress = int((downloaded / total_segments) * 100)
-                        self.progress_updated.emit(progress)
-                        
-                        # 保存进度
-                        with open(progress_file, 'w') as f:
-                            json.dump(list(self.downloaded_segments), f)
-                            
-                    except Exception as e:
-                        self.error_occurred.emit(f"下载片段失败: {str(e)}")
-                        return
+                    with self.queue_lock:
+                        while self.pending_segments and len(futures) < self.max_workers:
+                            index = self.pending_segments.popleft()
+                            future = executor.submit(
+                                self.download_segment,
+                                segment_urls[index],
+                                os.path.join(self.output_dir, f"segment_{index}.ts"),
+                                index
+                            )
+                            futures[future] = index
+
+                    done, _ = concurrent.futures.wait(
+                        futures, return_when=concurrent.futures.FIRST_COMPLETED
+                    )
+                    for future in done:
+                        del futures[future]
+                        try:
+                            index = future.result()
+                            self.downloaded_segments.add(str(index))
+                            downloaded += 1
+                            progress = int((downloaded / total_segments) * 100)
+                            self.progress_updated.emit(progress)
+
+                            # 保存进度
+                            with open(progress_file, 'w') as f:
+                                json.dump(list(self.downloaded_segments), f)
+
+                        except Exception as e:
+                            with self.queue_lock:
+                                self.pending_segments.clear()
+                            self.stop_preview()
+                            self.error_occurred.emit(f"下载片段失败: {str(e)}")
+                            return
 
             self.log("所有片段下载完成，开始合并...")
             self.merge_segments(total_segments)
             self.download_completed.emit()
 
         except Exception as e:
+            self.stop_preview()
             self.error_occurred.emit(str(e))
+        finally:
+            self.is_downloading = False
 
     def download_segment(self, segment_url, output_path, index):
         try:
             if not os.path.exists(output_path):
                 response = requests.get(segment_url, headers=self.headers)
                 response.raise_for_status()
-                with open(output_path, 'wb') as f:
-                    f.write(response.content)
+                # 先写临时文件再改名，避免边下边播读到不完整的片段
+                temp_path = output_path + '.part'
+                try:
+                    with open(temp_path, 'wb') as f:
+                        f.write(response.content)
+                    os.replace(temp_path, output_path)
+                except BaseException:
+                    if os.path.exists(temp_path):
+                        os.remove(temp_path)
+                    raise
             return index
         except Exception as e:
             raise Exception(f"下载片段 {segment_url} 失败: {str(e)}")
@@ -402,10 +585,14 @@ class MainWindow(QMainWindow):
         # 自动合成选项
         self.auto_merge = QCheckBox("下载完成后自动合成MP4")
         self.auto_merge.setChecked(True)
+
+        # 边下边播选项
+        self.enable_preview = QCheckBox("边下边播")
         
         advanced_layout.addWidget(thread_label)
         advanced_layout.addWidget(self.thread_spinner)
         advanced_layout.addStretch()
+        advanced_layout.addWidget(self.enable_preview)
         advanced_layout.addWidget(self.auto_merge)
         settings_layout.addLayout(advanced_layout)
 
@@ -493,6 +680,7 @@ class MainWindow(QMainWindow):
         self.mp4_path.setToolTip("选择合成后的MP4文件保存位置")
         self.thread_spinner.setToolTip("设置同时下载的线程数，建议值：4-16")
         self.auto_merge.setToolTip("下载完成后自动将视频片段合成为MP4文件")
+        self.enable_preview.setToolTip("启动本地HLS服务，可用播放器打开日志中的地址边下边播")
 
         # 在设置完输出路径的连接后添加
         self.output_path.textChanged.connect(self.check_enable_merge_button)
@@ -614,16 +802,22 @@ class MainWindow(QMainWindow):
 
         # 其他下载代码保持不变...
         try:
+            # 关闭上一次下载的边下边播服务
+            if hasattr(self, 'download_worker'):
+                self.download_worker.stop_preview()
+
             self.download_worker = DownloadWorker(
                 url,
                 self.headers_dialog.get_headers(),
                 output_dir,
-                self.thread_spinner.value()
+                self.thread_spinner.value(),
+                self.enable_preview.isChecked()
             )
             self.download_worker.progress_updated.connect(self.update_progress)
             self.download_worker.download_completed.connect(self.download_finished)
             self.download_worker.error_occurred.connect(self.handle_error)
             self.download_worker.log_message.connect(self.log)
+            self.download_worker.preview_ready.connect(self.show_preview_url)
             
             self.download_button.setEnabled(False)
             self.pause_button.setEnabled(True)
@@ -668,6 +862,15 @@ class MainWindow(QMainWindow):
     def show_headers_dialog(self):
         self.headers_dialog.show()
 
+    def show_preview_url(self, url):
+        QApplication.clipboard().setText(url)
+        self.log(f"边下边播地址: {url}（已复制到剪贴板）")
+
+    def closeEvent(self, event):
+        if hasattr(self, 'download_worker'):
+            self.download_worker.stop_preview()
+        super().closeEvent(event)
+
 if __name__ == '__main__':
     app = QApplication(sys.argv)
     window = MainWindow()
@@ -0,0 +1,279 @@
+import collections
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+pytest.importorskip("PyQt6")
+pytest.importorskip("m3u8")
+
+import m3u8_downloader
+from m3u8_downloader import DownloadWorker, PreviewServer
+
+
+PLAYLIST = """#EXTM3U
+#EXT-X-VERSION:3
+#EXT-X-TARGETDURATION:5
+#EXTINF:4.0,
+a.ts
+#EXTINF:4.5,
+b.ts
+#EXT-X-DISCONTINUITY
+#EXTINF:3.0,
+ad.ts
+#EXTINF:4.0,
+c.ts
+#EXT-X-ENDLIST
+"""
+
+
+class FakeResponse:
+    def __init__(self, content):
+        self.content = content
+        self.text = content.decode('utf-8')
+
+    def raise_for_status(self):
+        pass
+
+
+def make_worker(tmp_path, segments=10, max_workers=2):
+    worker = DownloadWorker("http://example.com/video.m3u8", {}, str(tmp_path), max_workers)
+    worker.segment_durations = [4.0] * segments
+    worker.segment_discontinuities = [False] * segments
+    return worker
+
+
+def test_prioritize_moves_window_to_front(tmp_path):
+    worker = make_worker(tmp_path)
+    worker.pending_segments = collections.deque(range(2, 10))
+    worker.prioritize_segment(6)
+    assert list(worker.pending_segments) == [6, 7, 8, 9, 2, 3, 4, 5]
+
+
+def test_prioritize_ignores_in_order_playback(tmp_path):
+    worker = make_worker(tmp_path)
+    worker.pending_segments = collections.deque(range(2, 10))
+    messages = []
+    worker.log_message.connect(messages.append)
+    worker.prioritize_segment(2)
+    assert list(worker.pending_segments) == list(range(2, 10))
+    assert messages == []
+
+
+def test_prioritize_ignores_downloaded_segment(tmp_path):
+    worker = make_worker(tmp_path)
+    worker.pending_segments = collections.deque(range(2, 10))
+    worker.prioritize_segment(1)
+    assert list(worker.pending_segments) == list(range(2, 10))
+
+
+@pytest.mark.parametrize("name", [
+    "segment_03.ts",
+    "segment_+3.ts",
+    "segment_ 3.ts",
+    "segment_0_3.ts",
+    "segment_-1.ts",
+    "segment_10.ts",
+    "segment_3.ts.part",
+    "../segment_3.ts",
+    "playlist.ts",
+])
+def test_segment_index_rejects_other_names(tmp_path, name):
+    assert make_worker(tmp_path).segment_index_from_name(name) is None
+
+
+def test_segment_index_from_name(tmp_path):
+    worker = make_worker(tmp_path)
+    assert worker.segment_index_from_name("segment_0.ts") == 0
+    assert worker.segment_index_from_name("segment_9.ts") == 9
+
+
+def test_build_preview_playlist(tmp_path):
+    worker = make_worker(tmp_path, segments=3)
+    worker.segment_durations = [4.0, 4.5, 3.0]
+    worker.segment_discontinuities = [False, False, True]
+    assert worker.build_preview_playlist() == (
+        "#EXTM3U\n"
+        "#EXT-X-VERSION:3\n"
+        "#EXT-X-TARGETDURATION:5\n"
+        "#EXT-X-MEDIA-SEQUENCE:0\n"
+        "#EXT-X-PLAYLIST-TYPE:VOD\n"
+        "#EXTINF:4.000,\n"
+        "segment_0.ts\n"
+        "#EXTINF:4.500,\n"
+        "segment_1.ts\n"
+        "#EXT-X-DISCONTINUITY\n"
+        "#EXTINF:3.000,\n"
+        "segment_2.ts\n"
+        "#EXT-X-ENDLIST\n"
+    )
+
+
+def run_worker(monkeypatch, worker, download_segment):
+    monkeypatch.setattr(m3u8_downloader.requests, "get",
+                        lambda url, headers=None: FakeResponse(PLAYLIST.encode('utf-8')))
+    monkeypatch.setattr(worker, "download_segment", download_segment)
+    monkeypatch.setattr(worker, "merge_segments", lambda total: None)
+    errors = []
+    worker.error_occurred.connect(errors.append)
+    worker.run()
+    return errors
+
+
+def test_run_keeps_discontinuities(tmp_path, monkeypatch):
+    worker = DownloadWorker("http://example.com/video.m3u8", {}, str(tmp_path), 2)
+    run_worker(monkeypatch, worker, lambda url, path, index: index)
+    assert worker.segment_discontinuities == [False, False, True, False]
+
+
+def test_run_caps_in_flight_segments(tmp_path, monkeypatch):
+    worker = DownloadWorker("http://example.com/video.m3u8", {}, str(tmp_path), 2)
+    lock = threading.Lock()
+    in_flight = [0]
+    peak = [0]
+    started = threading.Barrier(2)
+
+    def download_segment(url, path, index):
+        with lock:
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+        if index < 2:
+            started.wait(timeout=5)
+        with lock:
+            in_flight[0] -= 1
+        return index
+
+    errors = run_worker(monkeypatch, worker, download_segment)
+    assert errors == []
+    assert peak[0] == 2
+    with open(tmp_path / "download_progress.json") as f:
+        assert sorted(json.load(f)) == ["0", "1", "2", "3"]
+
+
+def test_run_reorders_while_downloading(tmp_path, monkeypatch):
+    worker = DownloadWorker("http://example.com/video.m3u8", {}, str(tmp_path), 1)
+    order = []
+
+    def download_segment(url, path, index):
+        if index == 0:
+            worker.prioritize_segment(3)
+        order.append(index)
+        return index
+
+    errors = run_worker(monkeypatch, worker, download_segment)
+    assert errors == []
+    assert order == [0, 3, 1, 2]
+
+
+def test_run_error_stops_queue_and_preview(tmp_path, monkeypatch):
+    worker = DownloadWorker("http://example.com/video.m3u8", {}, str(tmp_path), 1,
+                            enable_preview=True)
+    urls = []
+    worker.preview_ready.connect(urls.append)
+
+    def download_segment(url, path, index):
+        if index == 1:
+            raise Exception("boom")
+        return index
+
+    errors = run_worker(monkeypatch, worker, download_segment)
+    assert len(urls) == 1
+    assert len(errors) == 1 and "boom" in errors[0]
+    assert list(worker.pending_segments) == []
+    assert worker.preview_server is None
+    assert not worker.is_downloading
+
+
+@pytest.fixture
+def preview(tmp_path):
+    worker = make_worker(tmp_path, segments=4)
+    worker.pending_segments = collections.deque(range(1, 4))
+    worker.is_downloading = True
+    server = PreviewServer(worker)
+    server.start()
+    base_url = server.url.rsplit('/', 1)[0]
+    yield worker, base_url
+    server.stop()
+
+
+def fetch(url):
+    with urllib.request.urlopen(url, timeout=10) as response:
+        return response.status, response.headers['Content-Type'], response.read()
+
+
+def fetch_error(url):
+    with pytest.raises(urllib.error.HTTPError) as excinfo:
+        urllib.request.urlopen(url, timeout=10)
+    return excinfo.value.code
+
+
+def test_server_serves_playlist(preview):
+    worker, base_url = preview
+    status, content_type, body = fetch(f"{base_url}/playlist.m3u8")
+    assert status == 200
+    assert content_type == "application/vnd.apple.mpegurl"
+    assert body.decode('utf-8') == worker.build_preview_playlist()
+
+
+def test_server_serves_segment_on_disk(preview, tmp_path):
+    data = bytes(range(256)) * 10
+    (tmp_path / "segment_0.ts").write_bytes(data)
+    status, content_type, body = fetch(f"{preview[1]}/segment_0.ts")
+    assert status == 200
+    assert content_type == "video/mp2t"
+    assert body == data
+
+
+def test_server_waits_for_missing_segment(preview, tmp_path):
+    worker, base_url = preview
+    requested = []
+    original = worker.prioritize_segment
+
+    def prioritize_segment(index):
+        requested.append(index)
+        original(index)
+        (tmp_path / f"segment_{index}.ts").write_bytes(b"late")
+
+    worker.prioritize_segment = prioritize_segment
+    status, _, body = fetch(f"{base_url}/segment_2.ts")
+    assert status == 200
+    assert body == b"late"
+    assert requested == [2]
+    assert list(worker.pending_segments) == [2, 3, 1]
+
+
+def test_server_returns_503_when_not_downloading(preview):
+    worker, base_url = preview
+    worker.is_downloading = False
+    start = time.monotonic()
+    assert fetch_error(f"{base_url}/segment_2.ts") == 503
+    assert time.monotonic() - start < 1
+
+
+def test_server_returns_503_on_timeout(preview, monkeypatch):
+    monkeypatch.setattr(m3u8_downloader, "SEGMENT_WAIT_TIMEOUT", 0.2)
+    assert fetch_error(f"{preview[1]}/segment_2.ts") == 503
+
+
+@pytest.mark.parametrize("path", ["/segment_03.ts", "/../x", "/segment_4.ts", "/segment_99.ts"])
+def test_server_rejects_unknown_paths(preview, tmp_path, path):
+    (tmp_path / "segment_3.ts").write_bytes(b"three")
+    assert fetch_error(f"{preview[1]}{path}") == 404
+
+
+def test_download_segment_removes_part_file_on_failure(tmp_path, monkeypatch):
+    worker = make_worker(tmp_path)
+    monkeypatch.setattr(m3u8_downloader.requests, "get",
+                        lambda url, headers=None: FakeResponse(b"data"))
+
+    def failing_replace(src, dst):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(m3u8_downloader.os, "replace", failing_replace)
+    output_path = str(tmp_path / "segment_0.ts")
+    with pytest.raises(Exception, match="disk full"):
+        worker.download_segment("http://example.com/a.ts", output_path, 0)
+    assert list(tmp_path.iterdir()) == []